@@ -1,8 +1,18 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import math, io, datetime, base64
+from flask import Flask, Response, render_template, request
+import math, os, datetime, base64, hashlib, json, threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import orjson
+try:
+    from numba import njit
+except ImportError:  # fall back to plain Python kernels
+    def njit(*args, **kwargs):
+        return lambda func: func
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
 
 app = Flask(__name__, static_url_path="/static", static_folder="static", template_folder="templates")
 
@@ -12,18 +22,29 @@ app = Flask(__name__, static_url_path="/static", static_folder="static", templat
 C0 = 299792458.0  # speed of light (m/s)
 G = 9.80665        # gravity (m/s²)
 PI = math.pi
+TWO_OVER_LN10 = 2.0 / math.log(10.0)
+FREQS_HZ = np.logspace(5, 10, 101)  # SE sweep, 100 kHz – 10 GHz
+FREQS_HZ.flags.writeable = False     # shared by every result
+MAX_TUBES = 2500   # hard cap on solver tube count
 
 # ------------------------------
 # UNIT CONVERSIONS
 # ------------------------------
-def in_to_m(x): return x * 0.0254
-def ft_to_m(x): return x * 0.3048
-def psi_to_pa(x): return x * 6894.757
-def pa_to_psi(x): return x / 6894.757
-def cfm_to_m3s(x): return x * 0.00047194745
-def m3s_to_cfm(x): return x / 0.00047194745
-def lbft3_to_kgm3(x): return x * 16.0185
-def kgm3_to_lbft3(x): return x / 16.0185
+# Factors are multiplied inline on hot paths; the wrappers remain for other callers
+IN_TO_M = 0.0254
+FT_TO_M = 0.3048
+PSI_TO_PA = 6894.757
+CFM_TO_M3S = 0.00047194745
+LBFT3_TO_KGM3 = 16.0185
+
+def in_to_m(x): return x * IN_TO_M
+def ft_to_m(x): return x * FT_TO_M
+def psi_to_pa(x): return x * PSI_TO_PA
+def pa_to_psi(x): return x / PSI_TO_PA
+def cfm_to_m3s(x): return x * CFM_TO_M3S
+def m3s_to_cfm(x): return x / CFM_TO_M3S
+def lbft3_to_kgm3(x): return x * LBFT3_TO_KGM3
+def kgm3_to_lbft3(x): return x / LBFT3_TO_KGM3
 
 def F_to_C(F): return (F - 32.0) * 5.0 / 9.0
 def C_to_F(C): return C * 9.0 / 5.0 + 32.0
@@ -40,6 +61,10 @@ MATERIALS = {
     "carbon_steel": {"name": "Carbon Steel", "density_lbft3": 490.0, "roughness_ft": 7e-6, "color": "#6E7074"}
 }
 
+# Roughness in metres, computed once at import
+for _entry in MATERIALS.values():
+    _entry["roughness_m"] = ft_to_m(_entry["roughness_ft"])
+
 # ------------------------------
 # FLUID PROPERTIES
 # Density (kg/m³) and dynamic viscosity (Pa·s) tables vs. temperature
@@ -97,6 +122,12 @@ FLUIDS = {
     "nitrogen": {"name": "Nitrogen", "func": nitrogen_props},
     "glycol": {"name": "Ethylene Glycol", "func": glycol_props},
 }
+
+@lru_cache(maxsize=1024)
+def _fluid_props_cached(fluid_key, T_F_q):
+    """Memoized (rho, mu) for a fluid at a temperature quantized to 0.1 °F."""
+    return FLUIDS[fluid_key]["func"](T_F_q)
+
 # ------------------------------
 # FLOW PHYSICS FUNCTIONS
 # ------------------------------
@@ -105,38 +136,67 @@ def hydraulic_diameter_rect(a_m, b_m):
     """Hydraulic diameter for rectangular duct (used for Re & f)."""
     return 2.0 * a_m * b_m / (a_m + b_m)
 
+@njit(cache=True)
 def reynolds_number(rho, v, Dh, mu):
     """Calculate Reynolds number."""
     return (rho * v * Dh) / mu
 
+@njit(cache=True, fastmath=True)
 def colebrook_white(Re, rel_rough):
-    """Colebrook-White friction factor using Haaland approximation."""
+    """
+    Colebrook-White friction factor, solved iteratively with a single log call.
+    Each fixed-point step updates ln(z) with a Padé approximant of ln(z_new/z)
+    (Praks & Brkić), so no further transcendentals are evaluated.
+    """
     if Re <= 0: 
         return 0.02
     if Re < 2300: 
         return 64.0 / Re  # laminar flow
-    # turbulent regime
-    return ( -1.8 * math.log10( (rel_rough / 3.7)**1.11 + 6.9/Re ) ) ** -2
-
+    # turbulent regime: 1/sqrt(f) = -2 log10(rel_rough/3.7 + 2.51/(Re sqrt(f)))
+    a = rel_rough / 3.7
+    b = 2.51 / Re
+    z = a + 8.0 * b       # initial guess 1/sqrt(f) = 8
+    ln_z = math.log(z)
+    for _ in range(3):
+        z_new = a + b * (-TWO_OVER_LN10 * ln_z)
+        t = z_new / z - 1.0
+        ln_z += t * (6.0 + t) / (6.0 + 4.0 * t)  # [2/2] Padé of ln(1 + t)
+        z = z_new
+    x = -TWO_OVER_LN10 * ln_z
+    return 1.0 / (x * x)
+
+@njit(cache=True)
 def darcy_delta_p(f, L_m, Dh_m, rho, v):
     """Pressure loss (Pa) via Darcy–Weisbach."""
     return f * (L_m / Dh_m) * (rho * v**2 / 2.0)
 
+@njit(cache=True, fastmath=True)
+def _eval_dp(N, Q_total_m3s, A_m2, Dh_m, rho, mu, L_m, rel_rough):
+    """Compiled solver kernel: (ΔP Pa, velocity m/s) for N parallel tubes."""
+    v = Q_total_m3s / N / A_m2
+    Re = reynolds_number(rho, v, Dh_m, mu)
+    f = colebrook_white(Re, rel_rough)
+    return darcy_delta_p(f, L_m, Dh_m, rho, v), v
+
+_eval_dp(1, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1e-5)  # warm up / load the JIT cache
+
 def cutoff_frequency_rect(a_m):
     """Rectangular TE10 cutoff frequency (Hz)."""
     return C0 / (2.0 * a_m)
 
-def se_below_cutoff_db(a_m, L_m, f_hz):
-    """Shielding effectiveness below cutoff (attenuation)."""
+def se_below_cutoff_db_vec(a_m, L_m, freqs_arr):
+    """
+    Shielding effectiveness below cutoff (attenuation) over an array of frequencies (Hz).
+    a_m may also be an array shaped to broadcast against freqs_arr, e.g.
+    a_m[:, None] gives one SE curve per geometry.
+    """
     fc = cutoff_frequency_rect(a_m)
-    if f_hz >= fc:
-        return 0.0
     kc = 2.0 * math.pi * fc / C0
-    k = 2.0 * math.pi * f_hz / C0
-    alpha = math.sqrt(max(kc**2 - k**2, 0.0))
-    return 8.686 * alpha * L_m  # in dB
+    k = 2.0 * math.pi * freqs_arr / C0
+    alpha = np.sqrt(np.maximum(kc * kc - k * k, 0.0))
+    return np.where(freqs_arr >= fc, 0.0, 8.686 * alpha * L_m)  # in dB
 
-def tube_weight_lbm(a_in, b_in, t_in, L_ft, material):
+def tube_weight_lbm(a_in, b_in, t_in, L_ft, density_lbft3):
     """Estimate tube weight using wall volume × density."""
     a_out_in = a_in + 2*t_in
     b_out_in = b_in + 2*t_in
@@ -144,17 +204,34 @@ def tube_weight_lbm(a_in, b_in, t_in, L_ft, material):
     A_in_ft2 = (a_in/12.0)*(b_in/12.0)
     wall_area = max(0.0, A_out_ft2 - A_in_ft2)
     vol_ft3 = wall_area * L_ft
-    rho = MATERIALS[material]["density_lbft3"]
-    return vol_ft3 * rho
+    return vol_ft3 * density_lbft3
 
 # ------------------------------
 # AUTO TUBE SOLVER
 # ------------------------------
 
+def rect_array_dims(tube_count, aspect_ratio=2.0):
+    """
+    Smallest n×m array holding tube_count tubes whose long/short side ratio
+    stays within aspect_ratio (the near-square array is always allowed).
+    Ties go to the squarer array. Returns (n, m) with n ≥ m.
+    """
+    short = math.ceil(math.sqrt(tube_count))
+    long_ = math.ceil(tube_count / short)
+    best = (max(short, long_), min(short, long_))
+    for short in range(short - 1, 0, -1):
+        long_ = math.ceil(tube_count / short)
+        if long_ > aspect_ratio * short:
+            break  # ratio only grows as the short side shrinks
+        if long_ * short < best[0] * best[1]:
+            best = (long_, short)
+    return best
+
 def solve_tube_count(payload):
     """
     Automatically determine tube count that satisfies velocity and ΔP constraints.
-    Rounds up to the nearest full rectangular (n×m) array.
+    Rounds up to the smallest full rectangular (n×m) array within the
+    requested aspect ratio.
     """
     # Extract inputs
     a_in = float(payload.get("a_in", 2.0))
@@ -167,71 +244,147 @@ def solve_tube_count(payload):
     material = payload.get("material", "stainless_304")
     v_target = float(payload.get("v_target", 200.0))  # ft/s
     dP_max_psi = float(payload.get("dP_max", 1.0))    # psi
+    aspect_ratio = max(1.0, float(payload.get("aspect_ratio", 2.0)))  # max long/short side
+    mat = MATERIALS[material]
 
     # Convert key units
-    a_m, b_m, L_m = in_to_m(a_in), in_to_m(b_in), ft_to_m(L_ft)
-    rho, mu = FLUIDS[fluid]["func"](Tmax_F)
-    rho_lbft3 = kgm3_to_lbft3(rho)
+    a_m, b_m, L_m = a_in * IN_TO_M, b_in * IN_TO_M, L_ft * FT_TO_M
+    rho, mu = _fluid_props_cached(fluid, round(Tmax_F, 1))
 
     # Derived geometry
     Dh_m = hydraulic_diameter_rect(a_m, b_m)
     A_inner_m2 = a_m * b_m
-    rel_rough = (MATERIALS[material]["roughness_ft"] * 0.3048) / Dh_m
-
-    # Start iterating tube count
-    tube_count = 1
+    rel_rough = mat["roughness_m"] / Dh_m
+
+    # Velocity falls as 1/N, so the velocity constraint gives a closed-form
+    # lower bound on the tube count.
+    Q_m3s = cfm_total * CFM_TO_M3S
+    v_max = v_target * FT_TO_M
+
+    def evaluate(tube_count):
+        """Return (ΔP psi, velocity m/s) for a given tube count."""
+        dP_pa, v = _eval_dp(tube_count, Q_m3s, A_inner_m2, Dh_m, rho, mu, L_m, rel_rough)
+        return dP_pa / PSI_TO_PA, v
+
+    if v_max > 0:
+        tube_count = min(MAX_TUBES + 1, max(1, math.ceil(Q_m3s / (A_inner_m2 * v_max))))
+        # Guard against float round-off in the closed-form bound
+        while tube_count > 1 and Q_m3s / (tube_count - 1) / A_inner_m2 <= v_max:
+            tube_count -= 1
+        while tube_count <= MAX_TUBES and Q_m3s / tube_count / A_inner_m2 > v_max:
+            tube_count += 1
+    else:
+        tube_count = MAX_TUBES + 1
+
+    # ΔP decreases monotonically with N, so bisect for the smallest feasible N
     meets = False
     best_dp = 0.0
     best_v = 0.0
 
-    while tube_count <= 2500:  # hard cap
-        Q_m3s_each = cfm_to_m3s(cfm_total / tube_count)
-        v = Q_m3s_each / A_inner_m2
-        Re = reynolds_number(rho, v, Dh_m, mu)
-        f = colebrook_white(Re, rel_rough)
-        dP_pa = darcy_delta_p(f, L_m, Dh_m, rho, v)
-        dP_psi = pa_to_psi(dP_pa)
-
-        # Check constraints
-        if v <= ft_to_m(v_target) and dP_psi <= dP_max_psi:
+    if tube_count <= MAX_TUBES:
+        dP_psi, v = evaluate(tube_count)
+        if dP_psi <= dP_max_psi:
             meets = True
             best_dp, best_v = dP_psi, v
-            break
-        tube_count += 1
+        else:
+            hi_dp, hi_v = evaluate(MAX_TUBES)
+            if hi_dp <= dP_max_psi:
+                lo, hi = tube_count, MAX_TUBES
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    mid_dp, mid_v = evaluate(mid)
+                    if mid_dp <= dP_max_psi:
+                        hi, hi_dp, hi_v = mid, mid_dp, mid_v
+                    else:
+                        lo = mid
+                meets = True
+                tube_count = hi
+                best_dp, best_v = hi_dp, hi_v
+            else:
+                tube_count = MAX_TUBES + 1
 
     # Round to full rectangular array
-    n = math.ceil(math.sqrt(tube_count))
-    m = math.ceil(tube_count / n)
+    n, m = rect_array_dims(tube_count, aspect_ratio)
     rounded_count = n * m
 
-    per_tube_wt = tube_weight_lbm(a_in, b_in, t_in, L_ft, material)
+    per_tube_wt = tube_weight_lbm(a_in, b_in, t_in, L_ft, mat["density_lbft3"])
     total_weight = per_tube_wt * rounded_count
 
     # Attenuation vs frequency
-    freqs = [10**(5 + j*(5/100)) for j in range(101)]
-    SE_db = [se_below_cutoff_db(max(a_m,b_m), L_m, f) for f in freqs]
+    SE_db = se_below_cutoff_db_vec(max(a_m,b_m), L_m, FREQS_HZ)
     fc_hz = cutoff_frequency_rect(max(a_m,b_m))
 
     return {
         "tube_count": rounded_count,
         "array_dims": [n, m],
-        "velocity_fts": best_v / 0.3048,
+        "velocity_fts": best_v / FT_TO_M,
         "deltaP_psi": best_dp,
         "total_weight_lbm": total_weight,
-        "Dh_in": Dh_m / 0.0254,
+        "Dh_in": Dh_m / IN_TO_M,
         "fc_GHz": fc_hz / 1e9,
-        "freqs": freqs,
+        "freqs": FREQS_HZ,
         "SE_db": SE_db,
-        "material_color": MATERIALS[material]["color"],
+        "material_color": mat["color"],
         "a_in": a_in,
         "b_in": b_in,
         "L_ft": L_ft,
         "t_in": t_in
     }
+
+# Results keyed on a BLAKE2 digest of the canonical payload JSON, so the
+# usual /calculate → /report flow solves each design only once.
+RESULT_CACHE_SIZE = 256
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+def solve_tube_count_cached(payload):
+    """LRU-cached solve_tube_count; callers must treat the result as read-only."""
+    key = hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=16).digest()
+    with _result_cache_lock:
+        result = _result_cache.get(key)
+        if result is not None:
+            _result_cache.move_to_end(key)
+            return result
+
+    result = solve_tube_count(payload)
+    with _result_cache_lock:
+        _result_cache[key] = result
+        if len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+    return result
+
+# ------------------------------
+# PDF REPORT LAYOUT
+# ------------------------------
+REPORT_FONTS = ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique")
+for _font in REPORT_FONTS:
+    pdfmetrics.getFont(_font)  # load and register metrics once, not on the first report
+
+PAGE_W, PAGE_H = letter
+REPORT_TITLE = "Wave Pack Analysis Report"
+REPORT_NOTE = "Note: Results computed for worst-case (max temperature) flow condition."
+
 # ------------------------------
 # FLASK ROUTES
 # ------------------------------
 
+def json_response(obj, status=200):
+    """JSON response via orjson; NumPy arrays serialize without conversion."""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), status=status,
+                    mimetype="application/json")
+
+def _positive_array(value, name):
+    """Float array from a JSON number or list; raises ValueError unless all entries are finite and > 0."""
+    try:
+        arr = np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number or a list of numbers")
+    if arr.ndim > 1:
+        raise ValueError(f"{name} must be a number or a flat list of numbers")
+    if not np.all(np.isfinite(arr) & (arr > 0)):
+        raise ValueError(f"{name} values must be positive numbers")
+    return arr
+
 @app.route("/")
 def index():
     """Render main interface."""
@@ -241,30 +394,65 @@ def index():
 def calculate():
     """Perform waveguide calculation and return JSON results."""
     payload = request.get_json(force=True)
-    result = solve_tube_count(payload)
-    return jsonify(result)
+    result = solve_tube_count_cached(payload)
+    return json_response(result)
+
+@app.route("/calculate_batch", methods=["POST"])
+def calculate_batch():
+    """Shielding effectiveness curves for a list of aperture sizes (parametric sweep)."""
+    payload = request.get_json(force=True)
+    try:
+        if not isinstance(payload, dict):
+            raise ValueError("request body must be a JSON object")
+        a_in = np.atleast_1d(_positive_array(payload.get("a_in", [2.0]), "a_in"))
+        if a_in.size == 0:
+            raise ValueError("a_in must not be empty")
+        b_in = _positive_array(payload.get("b_in", a_in), "b_in")
+        if b_in.ndim == 1 and b_in.shape != a_in.shape:
+            raise ValueError("b_in must be a number or a list the same length as a_in")
+        b_in = np.broadcast_to(b_in, a_in.shape)
+        try:
+            L_ft = float(payload.get("L_ft", 3.0))
+        except (TypeError, ValueError):
+            L_ft = math.nan
+        if not (math.isfinite(L_ft) and L_ft >= 0):
+            raise ValueError("L_ft must be a non-negative number")
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+
+    a_m = in_to_m(np.maximum(a_in, b_in))
+    SE_db = se_below_cutoff_db_vec(a_m[:, None], ft_to_m(L_ft), FREQS_HZ)
+    fc_hz = cutoff_frequency_rect(a_m)
+
+    return json_response({
+        "a_in": a_in.tolist(),
+        "b_in": b_in.tolist(),
+        "L_ft": L_ft,
+        "fc_GHz": fc_hz / 1e9,
+        "freqs": FREQS_HZ,
+        "SE_db": SE_db
+    })
 
 @app.route("/report", methods=["POST"])
 def report():
     """Generate PDF report and send it to browser."""
     payload = request.get_json(force=True)
-    result = solve_tube_count(payload)
+    result = solve_tube_count_cached(payload)
 
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
+    # No backing file: the PDF bytes go straight into the response body
+    c = canvas.Canvas(None, pagesize=letter)
 
     # --- Header ---
     c.setFont("Helvetica-Bold", 16)
-    c.drawString(72, height - 72, "Wave Pack Analysis Report")
+    c.drawString(72, PAGE_H - 72, REPORT_TITLE)
     c.setFont("Helvetica", 10)
-    c.drawString(72, height - 90, f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    c.drawString(72, PAGE_H - 90, f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     # --- Inputs ---
     c.setFont("Helvetica-Bold", 12)
-    c.drawString(72, height - 120, "Input Parameters")
+    c.drawString(72, PAGE_H - 120, "Input Parameters")
     c.setFont("Helvetica", 10)
-    y = height - 135
+    y = PAGE_H - 135
     for k, v in [
         ("Shape", "Rectangular"),
         ("Material", MATERIALS[payload['material']]['name']),
@@ -298,17 +486,17 @@ def report():
     # --- Notes ---
     y -= 10
     c.setFont("Helvetica-Oblique", 9)
-    c.drawString(72, y, "Note: Results computed for worst-case (max temperature) flow condition.")
+    c.drawString(72, y, REPORT_NOTE)
 
     c.showPage()
-    c.save()
-    buffer.seek(0)
 
-    return send_file(buffer, as_attachment=True, download_name="Wavepack_Report.pdf", mimetype="application/pdf")
+    return Response(c.getpdfdata(), mimetype="application/pdf",
+                    headers={"Content-Disposition": "attachment; filename=Wavepack_Report.pdf"})
 
 # ------------------------------
 # MAIN SERVER LAUNCH
 # ------------------------------
+# Development server only; in production serve wsgi:app with gunicorn.
 if __name__ == "__main__":
-    import os
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)),
+            debug=os.environ.get("FLASK_DEBUG") == "1")
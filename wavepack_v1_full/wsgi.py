@@ -0,0 +1,12 @@
+"""
+Production WSGI entry point.
+
+    gunicorn -w 4 --preload wsgi:app
+
+--preload imports app once in the master process, so NumPy, the compiled
+Numba kernel and the frequency grid are built before the workers fork and
+are shared copy-on-write.
+"""
+from app import app
+
+__all__ = ["app"]